@@ -1,20 +1,159 @@
 # Swedish Population Analyzer
 # API/fallback to sample data
 
+import contextlib
+import functools
+import hashlib
+import os
+import sys
+
+import diskcache
+import numpy as np
+import orjson
 import pandas as pd
 import requests
 from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# The built sample frame is saved here (whenever sample data is used) so later
+# runs can skip constructing it. It is overwritten when the sample data changes;
+# saving needs pyarrow and is skipped with a note if that fails.
+SAMPLE_PARQUET = Path.home() / ".scb_sample.parquet"
+_VERSION_KEY = b"scb_sample_version"
+
+def _sample_data():
+    """
+    Return the sample columns as typed arrays.
+    """
+    # Columns are built with explicit dtypes so pandas doesn't have to infer them
+    return {
+        'Municipality': pd.array(['Stockholm', 'Göteborg', 'Malmö', 'Uppsala', 'Västerås', 
+                                  'Örebro', 'Linköping', 'Helsingborg', 'Jönköping', 'Norrköping',
+                                  'Lund', 'Umeå', 'Gävle', 'Borås', 'Eskilstuna'], dtype='string'),
+        'Population': np.asarray([975551, 579281, 347949, 230767, 154049, 
+                                  156381, 165618, 149280, 141081, 143171,
+                                  125542, 130224, 103318, 113641, 109382], dtype=np.int32),
+        'Area_km2': np.asarray([188, 203, 158, 2189, 1139,
+                                1380, 1436, 346, 1489, 1499,
+                                430, 2331, 1617, 915, 1243], dtype=np.int32),
+        'County': pd.array(['Stockholm', 'Västra Götaland', 'Skåne', 'Uppsala', 'Västmanland',
+                            'Örebro', 'Östergötland', 'Skåne', 'Jönköping', 'Östergötland',
+                            'Skåne', 'Västerbotten', 'Gävleborg', 'Västra Götaland', 'Södermanland'],
+                           dtype='category'),
+        'Founded': np.asarray([1252, 1621, 1275, 1286, 990,
+                               1200, 1120, 1085, 1284, 1384,
+                               990, 1622, 1446, 1621, 1659], dtype=np.int16)
+    }
+
+
+def _sample_version(sample_data):
+    """
+    Return a hash of the sample values and dtypes, stored with the saved file
+    so that editing either causes the file to be rebuilt.
+    """
+    digest = hashlib.sha1()
+    for name, values in sample_data.items():
+        digest.update(repr((name, str(values.dtype), values.tolist())).encode())
+    return digest.hexdigest()
+
+
+def _read_sample_df(version):
+    """
+    Read the saved sample frame, or return None if it was saved from
+    different sample data.
+    """
+    import pyarrow.parquet as pq
+    
+    table = pq.read_table(SAMPLE_PARQUET, memory_map=True)
+    if (table.schema.metadata or {}).get(_VERSION_KEY) != version.encode():
+        return None
+    return table.to_pandas()
+
+
+def _save_sample_df(df, version):
+    """
+    Save the sample frame, best effort. It is written to a temporary file and
+    moved into place, so an interrupted run never leaves a partial file behind.
+    """
+    tmp_path = SAMPLE_PARQUET.with_name(f"{SAMPLE_PARQUET.name}.{os.getpid()}.tmp")
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        metadata = {**(table.schema.metadata or {}), _VERSION_KEY: version.encode()}
+        pq.write_table(table.replace_schema_metadata(metadata), tmp_path)
+        os.replace(tmp_path, SAMPLE_PARQUET)
+    except Exception as e:
+        # Not fatal, the frame is simply rebuilt on the next run
+        print(f"Could not save sample data ({e})")
+    finally:
+        with contextlib.suppress(OSError):
+            tmp_path.unlink()
+
+
+@functools.lru_cache(maxsize=1)
+def _build_sample_df():
+    """
+    Build the canonical sample DataFrame, sorted by ascending population.
+    """
+    sample_data = _sample_data()
+    version = _sample_version(sample_data)
+    
+    if SAMPLE_PARQUET.exists():
+        try:
+            df = _read_sample_df(version)
+        except Exception as e:
+            print(f"Could not read saved sample data ({e}), rebuilding it...")
+            df = None
+        
+        # Callers rely on the population order, so never trust an unsorted file
+        if df is not None and 'Population' in df.columns and df['Population'].is_monotonic_increasing:
+            return df
+    
+    # Sort once up front so population lookups can rely on the order
+    # (stable, so tied rows keep their original order)
+    df = pd.DataFrame(sample_data).sort_values('Population', kind='stable', ignore_index=True)
+    _save_sample_df(df, version)
+    return df
+
 
 class SwedishPopulationAnalyzer:
     """
     Analyzes Swedish population data using pandas.
     Uses real SCB API data with fallback to sample data for offline use.
+    
+    The sample DataFrame is shared by all instances in a process, so don't
+    modify existing values of self.df in place (adding columns is fine).
     """
     
     def __init__(self):
         self.df = None
         self.results = {}
         self.data_source = None  # Track whether we used API or sample data
+        self._pop = None  # Population column as an array, shared between analyses
+        self._pop_sorted = False  # True when rows are ordered by ascending population
+        self._sorted_columns = {}  # Sorted copies of numeric columns, used for ranking
+        
+        # HTTP session that retries transient failures before we give up on the API
+        self._session = requests.Session()
+        retry = Retry(total=3, backoff_factor=0.3,
+                      status_forcelist=[500, 502, 503, 504], allowed_methods=["GET"])
+        self._session.mount("https://", HTTPAdapter(max_retries=retry))
+    
+    @property
+    def df(self):
+        """
+        The DataFrame being analyzed.
+        """
+        return self._df
+    
+    @df.setter
+    def df(self, value):
+        # Anything derived from the previous frame is stale once it's replaced
+        self._df = value
+        self._invalidate_cache()
     
     def _download_from_api(self):
         """
@@ -25,55 +164,58 @@ class SwedishPopulationAnalyzer:
         
         print("Attempting to download data from SCB API...")
         
-        # Makes API request
-        response = requests.get(api_url, timeout=10)
-        response.raise_for_status()  # Raises exception for bad status codes
-        
-        # Parse API response (this would need to be adapted to actual SCB format which is a bit complicated for this example)
-        api_data = response.json()
+        # Check the disk cache first so repeat runs skip the network round-trip.
+        # Opened here so a broken cache location only fails the API path.
+        key = hashlib.sha1(api_url.encode()).hexdigest()
+        with diskcache.Cache(Path.home() / ".scb_cache") as cache:
+            api_data = cache.get(key)
+            
+            if api_data is None:
+                # Makes API request
+                response = self._session.get(api_url, timeout=10)
+                response.raise_for_status()  # Raises exception for bad status codes
+                
+                # Parse API response (this would need to be adapted to actual SCB format which is a bit complicated for this example)
+                api_data = orjson.loads(response.content)  # C parser, faster than response.json()
+                cache.set(key, api_data, expire=86400)  # Keep for one day
         
         # Convert to DataFrame (simplified )
         #   actual SCB API parsing would be more complex
         raise NotImplementedError("SCB API parsing not yet implemented")
     
-    def _load_sample_data(self):
+    def _load_sample_data(self, refresh=False):
         """
         Load sample data for offline use and development.
+        
+        Args:
+            refresh (bool): If True, drop this process's cached sample frame first
         """
         print("Using sample data for offline analysis...")
         
-        sample_data = {
-            'Municipality': ['Stockholm', 'Göteborg', 'Malmö', 'Uppsala', 'Västerås', 
-                           'Örebro', 'Linköping', 'Helsingborg', 'Jönköping', 'Norrköping',
-                           'Lund', 'Umeå', 'Gävle', 'Borås', 'Eskilstuna'],
-            'Population': [975551, 579281, 347949, 230767, 154049, 
-                          156381, 165618, 149280, 141081, 143171,
-                          125542, 130224, 103318, 113641, 109382],
-            'Area_km2': [188, 203, 158, 2189, 1139,
-                        1380, 1436, 346, 1489, 1499,
-                        430, 2331, 1617, 915, 1243],
-            'County': ['Stockholm', 'Västra Götaland', 'Skåne', 'Uppsala', 'Västmanland',
-                      'Örebro', 'Östergötland', 'Skåne', 'Jönköping', 'Östergötland',
-                      'Skåne', 'Västerbotten', 'Gävleborg', 'Västra Götaland', 'Södermanland'],
-            'Founded': [1252, 1621, 1275, 1286, 990,
-                       1200, 1120, 1085, 1284, 1384,
-                       990, 1622, 1446, 1621, 1659]
-        }
+        if refresh:
+            _build_sample_df.cache_clear()
         
-        self.df = pd.DataFrame(sample_data)
+        self.df = _build_sample_df().copy(deep=False)
+        self._pop_sorted = True
         self.data_source = "sample"
         return True
     
-    def load_data(self, force_sample=False):
+    def load_data(self, force_sample=False, force_refresh=False):
         """
         Load data with automatic fallback from API to sample data.
         
         Args:
             force_sample (bool): If True, skip API and use sample data directly
+            force_refresh (bool): If True, reload even if data is already loaded.
+                Sample data is then reloaded from the saved file (or rebuilt)
+                instead of reusing the frame cached in this process.
         """
+        if self.df is not None and not force_refresh:
+            return True
+        
         if force_sample:
             print("Forced to use sample data...")
-            return self._load_sample_data()
+            return self._load_sample_data(refresh=force_refresh)
         
         try:
             # Try to get fresh data from API first
@@ -85,7 +227,33 @@ class SwedishPopulationAnalyzer:
         except Exception as e:
             print(f"API failed ({e})")
             print("Falling back to sample data...")
-            return self._load_sample_data()
+            return self._load_sample_data(refresh=force_refresh)
+    
+    def _invalidate_cache(self):
+        """
+        Drop values derived from the current DataFrame.
+        """
+        self._pop = None
+        self._pop_sorted = False
+        self._sorted_columns = {}
+        self.results = {}
+    
+    def _population(self):
+        """
+        Return the Population column as an array, computing it once per load.
+        """
+        if self._pop is None:
+            self._pop = self.df['Population'].to_numpy()
+        return self._pop
+    
+    def _density(self):
+        """
+        Return the density column, adding it to the DataFrame on first use.
+        """
+        if 'Density_per_km2' not in self.df.columns:
+            # Calculate population density on the raw arrays (skips index alignment)
+            self.df['Density_per_km2'] = self._population() / self.df['Area_km2'].to_numpy()
+        return self.df['Density_per_km2']
     
     def basic_analysis(self):
         """
@@ -95,27 +263,40 @@ class SwedishPopulationAnalyzer:
             print("No data loaded. Call load_data() first.")
             return
         
-        print("\n" + "="*50)
-        print(f"BASIC DATA ANALYSIS ({self.data_source} data)")
-        print("="*50)
+        # Basic statistics, computed once and reused for the stored results
+        pop = self._population()
+        total_population = pop.sum()
+        avg_population = pop.mean()
+        if self._pop_sorted:
+            # First row holding the maximum, matching idxmax on ties
+            idxmax, idxmin = int(np.searchsorted(pop, pop[-1], side='left')), 0
+        else:
+            idxmax, idxmin = int(pop.argmax()), int(pop.argmin())
+        largest_city = self.df['Municipality'].iat[idxmax]
+        
+        # Collect the report and write it to stdout in one call
+        buf = []
+        buf.append("\n" + "="*50)
+        buf.append(f"BASIC DATA ANALYSIS ({self.data_source} data)")
+        buf.append("="*50)
         
         # Dataset overview
-        print(f"Dataset shape: {self.df.shape}")
-        print(f"Missing values: {self.df.isnull().sum().sum()}")
+        buf.append(f"Dataset shape: {self.df.shape}")
+        buf.append(f"Missing values: {self.df.isnull().sum().sum()}")
         
-        # Basic statistics
-        print(f"\nPopulation Statistics:")
-        print(f"Total population: {self.df['Population'].sum():,}")
-        print(f"Average population: {self.df['Population'].mean():,.0f}")
-        print(f"Median population: {self.df['Population'].median():,.0f}")
-        print(f"Largest city: {self.df.loc[self.df['Population'].idxmax(), 'Municipality']}")
-        print(f"Smallest city: {self.df.loc[self.df['Population'].idxmin(), 'Municipality']}")
+        buf.append(f"\nPopulation Statistics:")
+        buf.append(f"Total population: {total_population:,}")
+        buf.append(f"Average population: {avg_population:,.0f}")
+        buf.append(f"Median population: {np.median(pop):,.0f}")
+        buf.append(f"Largest city: {largest_city}")
+        buf.append(f"Smallest city: {self.df['Municipality'].iat[idxmin]}")
+        sys.stdout.write("\n".join(buf) + "\n")
         
         # Store results
         self.results['basic_stats'] = {
-            'total_population': self.df['Population'].sum(),
-            'avg_population': self.df['Population'].mean(),
-            'largest_city': self.df.loc[self.df['Population'].idxmax(), 'Municipality'],
+            'total_population': total_population,
+            'avg_population': avg_population,
+            'largest_city': largest_city,
             'data_source': self.data_source
         }
     
@@ -130,19 +311,61 @@ class SwedishPopulationAnalyzer:
         print("POPULATION DENSITY ANALYSIS")
         print("="*50)
         
-        # Calculate population density
-        self.df['Density_per_km2'] = self.df['Population'] / self.df['Area_km2']
+        # Calculate population density (reused if already computed)
+        density = self._density().to_numpy()
         
-        # Sort by density
-        density_sorted = self.df.sort_values('Density_per_km2', ascending=False)
+        # Sort only the two columns we print instead of permuting the whole frame
+        order = np.argsort(density)
+        munis = self.df['Municipality'].to_numpy()[order]
+        density = density[order]
         
+        # Format each list in one pass and write it with a single print
         print("Top 5 Most Dense Cities:")
-        for i, row in density_sorted.head().iterrows():
-            print(f"{row['Municipality']}: {row['Density_per_km2']:.0f} people/km²")
+        print("\n".join(f"{muni}: {value:.0f} people/km²"
+                        for muni, value in zip(munis[::-1][:5], density[::-1][:5])))
         
         print("\nTop 5 Least Dense Cities:")
-        for i, row in density_sorted.tail().iterrows():
-            print(f"{row['Municipality']}: {row['Density_per_km2']:.0f} people/km²")
+        print("\n".join(f"{muni}: {value:.0f} people/km²"
+                        for muni, value in zip(munis[:5], density[:5])))
+    
+    def county_analysis(self):
+        """
+        Aggregate population per county.
+        """
+        if self.df is None:
+            return
+        
+        print("\n" + "="*50)
+        print("COUNTY ANALYSIS")
+        print("="*50)
+        
+        # Group on the categorical codes rather than hashing county names
+        county_totals = (self.df.groupby('County', sort=False, observed=True)['Population']
+                         .agg('sum')
+                         .sort_values(ascending=False))
+        
+        print("Population by County:")
+        for county, total in county_totals.items():
+            print(f"{county}: {total:,}")
+        
+        self.results['county_totals'] = county_totals
+    
+    def _rank(self, column, value):
+        """
+        Return the 1-based descending rank of value within column.
+        """
+        if column not in self._sorted_columns:
+            if column == 'Population':
+                values = self._population()
+                if not self._pop_sorted:
+                    values = np.sort(values)
+            else:
+                values = np.sort(self.df[column].to_numpy())
+            self._sorted_columns[column] = values
+        values = self._sorted_columns[column]
+        
+        # Everything to the right of value in the ascending array ranks above it
+        return len(values) - np.searchsorted(values, value, side='right') + 1
     
     def goteborg_focus(self):
         """
@@ -155,22 +378,29 @@ class SwedishPopulationAnalyzer:
         print("GÖTEBORG FOCUS ANALYSIS")
         print("="*50)
         
+        # Bind the columns once; density is needed even if the density analysis was skipped
+        pop = self._population()
+        density = self._density().to_numpy()
+        area = self.df['Area_km2'].to_numpy()
+        founded = self.df['Founded'].to_numpy()
+        munis = self.df['Municipality'].to_numpy()
+        
         # Get Göteborg data
-        goteborg = self.df[self.df['Municipality'] == 'Göteborg'].iloc[0]
+        i = np.flatnonzero(munis == 'Göteborg')[0]
         
         print(f"Göteborg Profile:")
-        print(f"Population: {goteborg['Population']:,}")
-        print(f"Area: {goteborg['Area_km2']:,} km²")
-        print(f"Density: {goteborg['Density_per_km2']:.0f} people/km²")
-        print(f"Founded: {goteborg['Founded']}")
+        print(f"Population: {pop[i]:,}")
+        print(f"Area: {area[i]:,} km²")
+        print(f"Density: {density[i]:.0f} people/km²")
+        print(f"Founded: {founded[i]}")
         
         # Ranking
-        pop_rank = (self.df['Population'] > goteborg['Population']).sum() + 1
-        density_rank = (self.df['Density_per_km2'] > goteborg['Density_per_km2']).sum() + 1
+        pop_rank = self._rank('Population', pop[i])
+        density_rank = self._rank('Density_per_km2', density[i])
         
         print(f"\nGöteborg Rankings:")
-        print(f"Population rank: #{pop_rank} out of {len(self.df)}")
-        print(f"Density rank: #{density_rank} out of {len(self.df)}")
+        print(f"Population rank: #{pop_rank} out of {len(pop)}")
+        print(f"Density rank: #{density_rank} out of {len(pop)}")
     
     def run_complete_analysis(self, force_sample=False):
         """
@@ -191,6 +421,7 @@ class SwedishPopulationAnalyzer:
         steps = [
             ("Basic Analysis", self.basic_analysis),
             ("Population Density", self.population_density_analysis),
+            ("County Analysis", self.county_analysis),
             ("Göteborg Focus", self.goteborg_focus)
         ]
         
@@ -221,14 +452,14 @@ def main():
     print("PYTHON SKILLS DEMONSTRATION")
     print("="*50)
     
-    # List comprehensions
-    large_cities = [city for city, pop in zip(analyzer.df['Municipality'], analyzer.df['Population']) 
-                   if pop > 150000]
+    # Boolean mask
+    is_large = analyzer.df['Population'].to_numpy() > 150_000
+    large_cities = analyzer.df['Municipality'].to_numpy()[is_large].tolist()
     print(f"Large cities (>150k): {large_cities}")
     
-    # Dictionary comprehension
-    city_populations = {row['Municipality']: row['Population'] 
-                       for _, row in analyzer.df.iterrows()}
+    # Dictionary from zipped columns
+    city_populations = dict(zip(analyzer.df['Municipality'].to_numpy(),
+                                analyzer.df['Population'].to_numpy()))
     print(f"Stockholm population: {city_populations.get('Stockholm', 'Not found'):,}")
 
 